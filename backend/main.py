@@ -1,6 +1,6 @@
 """
 基金数据后端服务
-使用 akshare 获取天天基金网数据
+直接调用天天基金网接口获取数据
 """
 import sys
 import io
@@ -10,29 +10,74 @@ if sys.platform == "win32":
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hashlib
+import os
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import msgspec
+import orjson
+from async_lru import alru_cache
+from diskcache import Cache
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import akshare as ak
-import pandas as pd
-from typing import List, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+import httpx
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 from datetime import datetime
-import requests
-from urllib.parse import quote
 
-app = FastAPI(title="基金数据服务", version="1.0.0")
+# 天天基金估值接口（JSONP 格式）
+FUNDGZ_BASE_URL = "https://fundgz.1234567.com.cn"
+FUNDGZ_PATH = "/js/{code}.js"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期
+    创建共享的上游 HTTP 客户端（连接池 + HTTP/2），并启动基金列表后台刷新任务
+    """
+    async with httpx.AsyncClient(
+        base_url=FUNDGZ_BASE_URL,
+        http2=True,
+        timeout=5,
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+    ) as client:
+        app.state.http = client
+        refresher = asyncio.create_task(_refresh_fund_list_loop())
+        try:
+            yield
+        finally:
+            refresher.cancel()
+            try:
+                await refresher
+            except asyncio.CancelledError:
+                pass
+
+
+app = FastAPI(
+    title="基金数据服务",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # 配置 CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET"],
+    allow_headers=["content-type"],
 )
 
+# 压缩较大的响应（如基金列表），低压缩级别以节省 CPU
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=1)
 
-class FundInfo(BaseModel):
+
+class FundInfo(msgspec.Struct):
     """基金信息模型"""
     code: str
     name: str
@@ -42,15 +87,30 @@ class FundInfo(BaseModel):
     day_growth: float  # 日增长率
 
 
-class FundSearchResult(BaseModel):
+class FundSearchResult(msgspec.Struct):
     """基金搜索结果"""
     code: str
     name: str
     type: str
 
 
-# 内存缓存 - 常见基金列表
-COMMON_FUNDS = [
+class MsgspecResponse(Response):
+    """使用 msgspec 序列化的 JSON 响应"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return msgspec.json.encode(content)
+
+
+class Fund(NamedTuple):
+    """常见基金条目"""
+    code: str
+    name: str
+    type: str
+
+
+# 常见基金原始数据
+_RAW_FUNDS = [
     {"code": "000001", "name": "华夏成长混合", "type": "mix"},
     {"code": "000002", "name": "华夏成长混合(ETF联接)", "type": "mix"},
     {"code": "000003", "name": "中国海油", "type": "stock"},
@@ -61,7 +121,6 @@ COMMON_FUNDS = [
     {"code": "270002", "name": "广发稳健增长混合", "type": "mix"},
     {"code": "519732", "name": "交银定期支付双息平衡混合", "type": "mix"},
     {"code": "001618", "name": "天弘中证电子ETF联接A", "type": "index"},
-    {"code": "001618", "name": "天弘中证电子ETF联接A", "type": "index"},
     {"code": "005827", "name": "易方达蓝筹精选混合", "type": "mix"},
     {"code": "161025", "name": "招商国证生物医药指数", "type": "index"},
     {"code": "163406", "name": "兴全合润混合", "type": "mix"},
@@ -82,21 +141,158 @@ COMMON_FUNDS = [
     {"code": "200002", "name": "长城久恒混合", "type": "mix"},
 ]
 
+# 内存缓存 - 常见基金列表（按代码去重，不可变）
+COMMON_FUNDS = tuple({f["code"]: Fund(**f) for f in _RAW_FUNDS}.values())
+
+# 基金代码 -> 基金条目
+_FUNDS_BY_CODE = {f.code: f for f in COMMON_FUNDS}
+
+
+def _build_code_index(funds: Tuple[Fund, ...]) -> Dict[str, List[Fund]]:
+    """为基金代码的所有子串建立索引，代码查询可直接命中"""
+    index: Dict[str, List[Fund]] = defaultdict(list)
+    for fund in funds:
+        code = fund.code
+        substrings = {code[i:j] for i in range(len(code)) for j in range(i + 1, len(code) + 1)}
+        for sub in substrings:
+            index[sub].append(fund)
+    return dict(index)
+
+
+# 搜索索引 - 启动时预先计算，避免每次请求重复转换小写
+_NAME_INDEX = [(fund.name.lower(), fund) for fund in COMMON_FUNDS]
+_CODE_INDEX = _build_code_index(COMMON_FUNDS)
+
+# 名称中含数字的基金（如 "中证500"），数字查询时需同时匹配名称
+_DIGIT_NAME_INDEX = [(name, fund) for name, fund in _NAME_INDEX if any(c.isdigit() for c in name)]
+
+# 基金在列表中的位置，用于合并结果时保持原有顺序
+_FUND_POSITION = {fund.code: i for i, fund in enumerate(COMMON_FUNDS)}
+
+
+# 限制对上游的并发请求数，避免请求过于密集
+_upstream_semaphore = asyncio.Semaphore(10)
+
+
+# 磁盘缓存 - 保存最近一次成功获取的净值，进程重启后仍可用
+_nav_disk_cache = Cache(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "nav"))
+
+# 缓存有效期（秒）：实时估值 5 分钟，最近净值 24 小时
+QUOTE_TTL = 300
+NAV_DISK_TTL = 86400
+
+
+async def _request_nav(code: str) -> dict:
+    """
+    从天天基金估值接口获取基金最新净值
+    响应格式: jsonpgz({...});
+    """
+    resp = await app.state.http.get(FUNDGZ_PATH.format(code=code))
+    resp.raise_for_status()
+
+    text = resp.text.strip()
+    start = text.find("(")
+    end = text.rfind(")")
+    payload = text[start + 1:end] if 0 <= start < end else ""
+    if not payload:
+        # 不存在的基金返回 jsonpgz();
+        raise ValueError(f"无法解析基金 {code} 的净值数据")
+
+    data = orjson.loads(payload)
+    return {
+        "code": data.get("fundcode") or code,
+        "name": data.get("name", ""),
+        "value": float(data.get("gsz") or data.get("dwjz") or 1.500),
+        "day_growth": float(data.get("gszzl") or 0.0),
+        "value_date": (data.get("gztime") or data.get("jzrq") or datetime.now().strftime("%Y-%m-%d"))[:10],
+    }
+
+
+@alru_cache(maxsize=2048, ttl=QUOTE_TTL)
+async def _fetch_nav(code: str) -> dict:
+    """
+    获取基金最新净值
+    结果按基金代码缓存 5 分钟，并发的相同请求只会访问一次上游；
+    上游失败时抛出异常，不会缓存
+    """
+    data = await _request_nav(code)
+
+    # 磁盘缓存为同步 SQLite 操作，放到线程中执行，避免阻塞事件循环
+    try:
+        await asyncio.to_thread(_nav_disk_cache.set, f"nav:{code}", data, expire=NAV_DISK_TTL)
+    except Exception as e:
+        print(f"写入基金 {code} 净值磁盘缓存失败: {e}")
+    return data
+
+
+async def _get_nav(code: str) -> Tuple[dict, bool]:
+    """
+    获取基金最新净值，返回 (净值数据, 是否为过期数据)
+    上游失败时使用磁盘中 24 小时内的净值，过期数据不进入内存缓存
+    """
+    try:
+        return await _fetch_nav(code), False
+    except Exception:
+        cached = await asyncio.to_thread(_nav_disk_cache.get, f"nav:{code}")
+        if cached is None:
+            raise
+        return cached, True
+
+
+async def _fetch_nav_safe(code: str) -> Optional[dict]:
+    """
+    获取基金净值和日增长率
+    返回 {"value", "day_growth", "stale"}，stale 表示来自磁盘的过期数据；失败时返回 None
+    """
+    async with _upstream_semaphore:
+        try:
+            data, stale = await _get_nav(code)
+            return {"value": data["value"], "day_growth": data["day_growth"], "stale": stale}
+        except Exception as e:
+            print(f"获取基金 {code} 净值失败: {e}")
+            return None
+
+
+# 基金代码前缀 -> 类型，四位前缀优先于三位前缀
+_TYPE_BY_PREFIX4 = {
+    '1617': 'index', '1634': 'index',  # 指数型
+}
+_TYPE_BY_PREFIX3 = {
+    '000': 'mix', '001': 'mix', '002': 'mix',  # 混合型
+    '510': 'index',  # 指数型
+    '519': 'stock', '161': 'stock', '050': 'stock',  # 股票型
+    '005': 'bond', '270': 'bond',  # 债券型
+    '003': 'money', '004': 'money',  # 货币型
+}
+
 
 def get_fund_type(code: str) -> str:
-    """根据基金代码判断类型"""
-    if code.startswith('000') or code.startswith('001') or code.startswith('002'):
-        return 'mix'  # 混合型
-    elif code.startswith('1617') or code.startswith('1634') or code.startswith('510'):
-        return 'index'  # 指数型
-    elif code.startswith('519') or code.startswith('161') or code.startswith('050'):
-        return 'stock'  # 股票型
-    elif code.startswith('1619') or code.startswith('005') or code.startswith('270'):
-        return 'bond'  # 债券型
-    elif code.startswith('003') or code.startswith('004'):
-        return 'money'  # 货币型
-    else:
-        return 'mix'  # 默认混合型
+    """根据基金代码判断类型，未知前缀默认混合型"""
+    return _TYPE_BY_PREFIX4.get(code[:4]) or _TYPE_BY_PREFIX3.get(code[:3], 'mix')
+
+
+# HTTP 缓存策略，允许浏览器和 CDN 复用响应
+LIST_CACHE_CONTROL = "public, max-age=300, stale-while-revalidate=60"
+QUOTE_CACHE_CONTROL = "public, max-age=60"
+
+
+def _make_etag(data: dict) -> str:
+    """
+    根据净值数据生成弱 ETag
+    响应体中的 timestamp 不参与计算，因此只能作为弱校验器
+    """
+    digest = hashlib.blake2b(orjson.dumps(data), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """按弱比较判断 If-None-Match 是否命中，支持多个标签和 *"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
 
 
 @app.get("/")
@@ -110,66 +306,81 @@ async def root():
     }
 
 
-@app.get("/api/funds/list", response_model=List[FundInfo])
-async def get_fund_list():
+# 基金列表刷新间隔（秒）
+FUND_LIST_REFRESH_INTERVAL = 300
+
+# 后台任务刷新的基金列表，请求直接读取
+# list: 基金列表；live: 本次刷新中所有基金均获取到上游实时净值
+_fund_list_state: Dict[str, Any] = {}
+
+
+def _fund_entry(fund: Fund, value: float = 1.500, day_growth: float = 0.0) -> FundInfo:
+    """构建基金列表条目，未提供净值时使用默认值"""
+    return FundInfo(
+        code=fund.code,
+        name=fund.name,
+        type=fund.type,
+        company="",
+        value=value,
+        day_growth=day_growth
+    )
+
+
+def _default_fund_list() -> List[FundInfo]:
+    """后台任务尚未完成首次刷新时返回的默认基金列表"""
+    return [_fund_entry(fund) for fund in COMMON_FUNDS[:20]]
+
+
+async def _refresh_fund_list():
     """
-    获取基金列表（常见基金）
-    返回常见基金列表
+    刷新基金列表
+    获取失败的基金保留上一次的条目（没有则使用默认值）；
+    有基金获取失败或只有磁盘过期数据时，本次结果不标记为实时
     """
-    try:
-        # 尝试获取实时数据
+    funds_to_fetch = COMMON_FUNDS[:20]  # 限制返回数量
+
+    # 并发获取各基金净值
+    navs = await asyncio.gather(*(_fetch_nav_safe(f.code) for f in funds_to_fetch))
+
+    previous = {entry.code: entry for entry in _fund_list_state.get("list", [])}
+    funds = []
+    for fund, nav in zip(funds_to_fetch, navs):
+        if nav is not None:
+            funds.append(_fund_entry(fund, nav["value"], nav["day_growth"]))
+        else:
+            funds.append(previous.get(fund.code) or _fund_entry(fund))
+
+    _fund_list_state["list"] = funds
+    _fund_list_state["live"] = all(nav is not None and not nav["stale"] for nav in navs)
+
+
+async def _refresh_fund_list_loop():
+    """定时刷新基金列表"""
+    while True:
         try:
-            # 使用 akshare 获取基金数据
-            df = ak.fund_em_open_fund_daily_em(fund="000001", symbol="单位净值")
-            if not df.empty:
-                funds = []
-                for fund_dict in COMMON_FUNDS[:20]:  # 限制返回数量
-                    try:
-                        # 获取该基金的净值
-                        fund_df = ak.fund_em_open_fund_daily_em(fund=fund_dict["code"], symbol="单位净值")
-                        if not fund_df.empty:
-                            latest = fund_df.iloc[0]
-                            funds.append(FundInfo(
-                                code=fund_dict["code"],
-                                name=fund_dict["name"],
-                                type=fund_dict["type"],
-                                company="",
-                                value=float(latest.get('单位净值', 1.0)),
-                                day_growth=0.0
-                            ))
-                    except:
-                        # 如果获取失败，使用默认值
-                        funds.append(FundInfo(
-                            code=fund_dict["code"],
-                            name=fund_dict["name"],
-                            type=fund_dict["type"],
-                            company="",
-                            value=1.500,
-                            day_growth=0.0
-                        ))
-                return funds
+            await _refresh_fund_list()
         except Exception as e:
-            print(f"获取实时数据失败: {e}")
-
-        # 返回默认基金列表
-        funds = []
-        for fund_dict in COMMON_FUNDS:
-            funds.append(FundInfo(
-                code=fund_dict["code"],
-                name=fund_dict["name"],
-                type=fund_dict["type"],
-                company="",
-                value=1.500,
-                day_growth=0.0
-            ))
-        return funds
+            print(f"刷新基金列表失败: {e}")
+        await asyncio.sleep(FUND_LIST_REFRESH_INTERVAL)
 
-    except Exception as e:
-        print(f"获取基金列表失败: {e}")
-        return []
+
+@app.get("/api/funds/list", response_class=MsgspecResponse)
+async def get_fund_list():
+    """
+    获取基金列表（常见基金）
+    返回后台任务最近一次刷新的结果
+    """
+    funds = _fund_list_state.get("list")
+    if funds is None:
+        return MsgspecResponse(_default_fund_list())
+
+    # 仅在列表全部为上游实时净值时允许缓存
+    if not _fund_list_state.get("live"):
+        return MsgspecResponse(funds)
+    return MsgspecResponse(funds, headers={"Cache-Control": LIST_CACHE_CONTROL})
 
 
-@app.get("/api/funds/search", response_model=List[FundSearchResult])
+@app.get("/api/funds/search", response_class=MsgspecResponse)
 async def search_funds(q: str = "", limit: int = 20):
     """
     搜索基金
@@ -177,71 +388,73 @@ async def search_funds(q: str = "", limit: int = 20):
     :param limit: 返回结果数量限制
     """
     if not q or len(q) < 1:
-        return []
+        return MsgspecResponse([])
 
-    search_lower = q.lower()
-    results = []
+    limit = max(limit, 0)
 
-    # 从本地基金列表中搜索
-    for fund in COMMON_FUNDS:
-        if len(results) >= limit:
-            break
-
-        # 匹配基金代码或名称
-        if (search_lower in fund["code"].lower() or
-            search_lower in fund["name"].lower()):
-            results.append(FundSearchResult(
-                code=fund["code"],
-                name=fund["name"],
-                type=fund["type"]
-            ))
-
-    return results
+    if q.isdigit():
+        # 数字查询：代码命中索引，再合并名称含该数字的基金，按列表顺序返回
+        hits = {fund.code: fund for fund in _CODE_INDEX.get(q, [])}
+        for name_lower, fund in _DIGIT_NAME_INDEX:
+            if q in name_lower:
+                hits[fund.code] = fund
+        matches = sorted(hits.values(), key=lambda fund: _FUND_POSITION[fund.code])[:limit]
+    else:
+        # 名称查询扫描预先转换的小写名称
+        search_lower = q.lower()
+        matches = []
+        for name_lower, fund in _NAME_INDEX:
+            if len(matches) >= limit:
+                break
+            if search_lower in name_lower:
+                matches.append(fund)
+
+    return MsgspecResponse([
+        FundSearchResult(
+            code=fund.code,
+            name=fund.name,
+            type=fund.type
+        )
+        for fund in matches
+    ])
 
 
 @app.get("/api/funds/{fund_code}/quote")
-async def get_fund_quote(fund_code: str):
+async def get_fund_quote(fund_code: str, request: Request, response: Response):
     """
     获取基金实时报价
     :param fund_code: 基金代码
     """
     try:
         # 尝试获取实时净值
-        df = ak.fund_em_open_fund_daily_em(fund=fund_code, symbol="单位净值")
-
-        if df.empty:
-            # 如果获取失败，从本地列表查找
-            fund_info = next((f for f in COMMON_FUNDS if f["code"] == fund_code), None)
-            if fund_info:
-                return {
-                    "code": fund_code,
-                    "name": fund_info["name"],
-                    "value": 1.500,
-                    "day_growth": 0.0,
-                    "value_date": datetime.now().strftime("%Y-%m-%d"),
-                    "timestamp": datetime.now().isoformat()
-                }
-            raise HTTPException(status_code=404, detail="基金不存在")
-
-        latest = df.iloc[0]
+        data, stale = await _get_nav(fund_code)
+        if stale:
+            # 过期数据不设置缓存头，避免客户端和 CDN 当作最新净值缓存
+            return {
+                **data,
+                "timestamp": datetime.now().isoformat()
+            }
 
+        # 净值未变化时返回 304，客户端直接使用本地缓存
+        etag = _make_etag(data)
+        cache_headers = {"ETag": etag, "Cache-Control": QUOTE_CACHE_CONTROL}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=cache_headers)
+
+        response.headers.update(cache_headers)
         return {
-            "code": fund_code,
-            "name": latest.get('基金名称', ''),
-            "value": float(latest.get('单位净值', 1.500)),
-            "day_growth": 0.0,
-            "value_date": str(latest.get('净值日期', datetime.now().strftime("%Y-%m-%d"))),
+            **data,
             "timestamp": datetime.now().isoformat()
         }
 
     except Exception as e:
         print(f"获取基金报价失败: {e}")
         # 返回模拟数据
-        fund_info = next((f for f in COMMON_FUNDS if f["code"] == fund_code), None)
+        fund_info = _FUNDS_BY_CODE.get(fund_code)
         if fund_info:
             return {
                 "code": fund_code,
-                "name": fund_info["name"],
+                "name": fund_info.name,
                 "value": 1.500,
                 "day_growth": 0.0,
                 "value_date": datetime.now().strftime("%Y-%m-%d"),
@@ -258,9 +471,22 @@ async def get_fund_quote(fund_code: str):
             }
 
 
+# 工作进程数，默认单进程
+# 每个进程都有独立的后台刷新任务、净值缓存和上游并发限制，进程越多上游请求量越大
+WORKERS = max(int(os.getenv("WORKERS", "1")), 1)
+
+
 if __name__ == "__main__":
     import uvicorn
     print("🚀 基金数据服务启动中...")
     print(f"📊 已加载 {len(COMMON_FUNDS)} 只常见基金")
     print("🔗 API 文档: http://localhost:8001/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8001,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop 不支持 Windows
+        http="httptools",
+        workers=WORKERS,
+        access_log=False,
+    )